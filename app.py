@@ -3,10 +3,28 @@
 Single main file for Render deployment.
 
 Usage on Render:
-- Web service (Flask) start command:
+- Single web service (Flask reset pages + Telegram webhook) start command:
+    gunicorn app:asgi_app -b 0.0.0.0:$PORT
+  with GUNICORN_WORKER_CLASS=uvicorn_worker.UvicornWorker and WEB_CONCURRENCY=1
+  (conversation state lives in process memory, so keep a single worker)
+- Web pages only (no bot), gevent workers from gunicorn.conf.py:
     gunicorn app:web_app -b 0.0.0.0:$PORT
-- Worker (Telegram polling bot) start command:
+  equivalent explicit form:
+    gunicorn -k gevent --worker-connections=1000 --workers=$((2*NPROC+1)) app:web_app
+  or sync-style threaded workers: GUNICORN_WORKER_CLASS=gthread
+- Local testing of the bot with polling:
     python app.py bot
+- Optional maintenance command deleting tokens expired for more than a day (run it by hand or from a scheduler):
+    python app.py purge
+
+Existing Postgres databases don't get schema changes from create_all; apply them by hand:
+    DROP INDEX CONCURRENTLY IF EXISTS reset_tokens_live;
+    CREATE INDEX CONCURRENTLY reset_tokens_live ON reset_tokens (token)
+        INCLUDE (email, expires_at) WHERE used = false;
+    ALTER TABLE reset_tokens
+        ALTER COLUMN created_at TYPE timestamptz USING created_at AT TIME ZONE 'UTC',
+        ALTER COLUMN expires_at TYPE timestamptz USING expires_at AT TIME ZONE 'UTC',
+        ALTER COLUMN token TYPE varchar(48) COLLATE "C";
 
 ENV (required):
 - BOT_TOKEN            -> Telegram bot token
@@ -14,38 +32,73 @@ ENV (required):
 - RESET_PATH           -> path for reset endpoint (default: /reset)
 - RESET_EXPIRY_MINUTES -> token expiry (default: 60)
 - SMTP_HOST, SMTP_PORT, SMTP_USER, SMTP_PASS, FROM_EMAIL -> SMTP for sending emails
+- TOKEN_SIGNING_KEY    -> secret for signing reset tokens; must be the same for every process
+  (TOKEN_SIGNING_KEY_DEV=1 allows a random per-process key, only useful when web and bot share a process)
 - DATABASE_URL         -> SQLAlchemy DB URL (Render Postgres). If omitted, falls back to sqlite file reset_tokens.db
+- REDIS_URL            -> optional Redis URL used as a front cache for token lookups
+- GUNICORN_WORKER_CLASS -> gunicorn worker class (default: gevent; use uvicorn_worker.UvicornWorker for asgi_app)
+- WSGI_THREADS         -> Flask request threads per worker when serving asgi_app (default: 10)
+- GEVENT_PATCH         -> set to 1 to gevent-monkey-patch at import (gunicorn.conf.py sets it for gevent workers)
 
 Dependencies (put in requirements.txt):
 flask
 python-telegram-bot==20.4
-SQLAlchemy
+SQLAlchemy>=2.0
 psycopg2-binary
+redis
+gevent
+psycogreen
+a2wsgi
+uvicorn
+uvicorn-worker
+orjson
 
 This file implements:
-- a small Flask web app (object: web_app) serving /reset
-- a Telegram bot (polling) to request reset tokens and email users
+- a small Flask web app (object: web_app) serving /reset/<token>
+- a Telegram bot to request reset tokens and email users, served as a webhook
+  at /tg/<BOT_TOKEN> by the ASGI wrapper (object: asgi_app), or polling for local testing
 - DB layer using SQLAlchemy (works with Postgres or sqlite fallback)
 
 Only use this for your own application accounts. Do NOT use for other services.
 """
 
 import os
-import re
+
+# must run before anything imports socket/ssl, so DB/Redis/SMTP I/O yields to other greenlets
+if os.environ.get("GEVENT_PATCH") == "1":
+    from gevent import monkey
+    monkey.patch_all()
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+import hmac
+import html
+import json
+import base64
+import struct
+import hashlib
 import sys
+import time
+import asyncio
 import secrets
+import threading
 import smtplib
 import ssl
-from datetime import datetime, timedelta
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from email.message import EmailMessage
 
-from flask import Flask, request, render_template_string
+from flask import Flask, Response, request, redirect, url_for, render_template_string
+from flask.json.provider import DefaultJSONProvider
+import orjson
+from a2wsgi import WSGIMiddleware
 
 # SQLAlchemy
-from sqlalchemy import (create_engine, Column, Integer, String, DateTime,
-                        Boolean)
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import (create_engine, String, DateTime, Boolean, Index,
+                        text, bindparam, select, delete, func)
+from sqlalchemy.orm import (DeclarativeBase, Mapped, mapped_column,
+                            sessionmaker, scoped_session)
 
 # Telegram
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -57,6 +110,7 @@ from telegram.ext import (Application, CommandHandler, CallbackQueryHandler,
 # -----------------------------
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
 FRONTEND_BASE = os.environ.get("FRONTEND_BASE", "http://localhost:8000")
+FRONTEND_BASE_CLEAN = FRONTEND_BASE.rstrip("/")
 RESET_PATH = os.environ.get("RESET_PATH", "/reset")
 RESET_EXPIRY_MINUTES = int(os.environ.get("RESET_EXPIRY_MINUTES", "60"))
 
@@ -67,110 +121,305 @@ SMTP_PASS = os.environ.get("SMTP_PASS")
 FROM_EMAIL = os.environ.get("FROM_EMAIL", SMTP_USER)
 
 DATABASE_URL = os.environ.get("DATABASE_URL")
+REDIS_URL = os.environ.get("REDIS_URL")
+WSGI_THREADS = int(os.environ.get("WSGI_THREADS", "10"))
+TOKEN_SIGNING_KEY = os.environ.get("TOKEN_SIGNING_KEY", "").encode()
+
+# -----------------------------
+# Signed tokens
+# -----------------------------
+# token = base64url(expiry:u32 || nonce:16 || hmac_sha256(key, expiry || nonce)[:16]), 48 chars.
+# The signature and expiry are checked in-process, so forged/expired tokens never reach Redis or the DB.
+_TOKEN_PAYLOAD = struct.Struct(">I16s")
+TOKEN_MAC_BYTES = 16
+TOKEN_LENGTH = 48
+
+if not TOKEN_SIGNING_KEY:
+    if os.environ.get("TOKEN_SIGNING_KEY_DEV") != "1":
+        raise RuntimeError("TOKEN_SIGNING_KEY env variable is required (the same value for web and bot). "
+                           "Set TOKEN_SIGNING_KEY_DEV=1 to use a throwaway per-process key.")
+    print("TOKEN_SIGNING_KEY not set; using a random per-process key (tokens only verify in this process).")
+    TOKEN_SIGNING_KEY = secrets.token_bytes(32)
+
+def _token_mac(payload: bytes) -> bytes:
+    return hmac.new(TOKEN_SIGNING_KEY, payload, hashlib.sha256).digest()[:TOKEN_MAC_BYTES]
+
+def sign_token(expires: datetime) -> str:
+    payload = _TOKEN_PAYLOAD.pack(int(expires.timestamp()), secrets.token_bytes(16))
+    return base64.urlsafe_b64encode(payload + _token_mac(payload)).decode()
+
+def verify_token(token: str) -> bool:
+    if len(token) != TOKEN_LENGTH:
+        return False
+    try:
+        raw = base64.urlsafe_b64decode(token)
+    except ValueError:
+        return False
+    payload, mac = raw[:_TOKEN_PAYLOAD.size], raw[_TOKEN_PAYLOAD.size:]
+    if not hmac.compare_digest(mac, _token_mac(payload)):
+        return False
+    expiry, _nonce = _TOKEN_PAYLOAD.unpack(payload)
+    return expiry > time.time()
 
 # -----------------------------
 # DB setup
 # -----------------------------
 if DATABASE_URL:
     DATABASE_URL_USED = DATABASE_URL
-    engine = create_engine(DATABASE_URL_USED, pool_pre_ping=True)
+    # keep a warm pool so each reset doesn't pay a fresh connect/TLS/auth handshake
+    engine = create_engine(DATABASE_URL_USED, pool_pre_ping=True,
+                           pool_size=10, max_overflow=20, pool_recycle=1800)
 else:
     # fallback to sqlite file for quick testing (not recommended for prod)
     DATABASE_URL_USED = "sqlite:///reset_tokens.db"
     engine = create_engine(DATABASE_URL_USED, connect_args={"check_same_thread": False})
 
-Base = declarative_base()
+class Base(DeclarativeBase):
+    pass
 
 class ResetToken(Base):
     __tablename__ = "reset_tokens"
-    id = Column(Integer, primary_key=True)
-    email = Column(String, nullable=False, index=True)
-    token = Column(String, nullable=False, unique=True, index=True)
-    created_at = Column(DateTime, nullable=False)
-    expires_at = Column(DateTime, nullable=False)
-    used = Column(Boolean, default=False)
-
-SessionLocal = sessionmaker(bind=engine)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    email: Mapped[str] = mapped_column(String, index=True)
+    # signed tokens are always TOKEN_LENGTH chars; "C" collation makes B-tree compares plain memcmp on Postgres
+    token: Mapped[str] = mapped_column(
+        String(TOKEN_LENGTH).with_variant(String(TOKEN_LENGTH, collation="C"), "postgresql"),
+        unique=True, index=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    used: Mapped[bool] = mapped_column(Boolean, default=False)
+
+    __table_args__ = (
+        # partial index: live-token probes only touch unused rows, so it stays O(live tokens).
+        # INCLUDE covers the columns get_live_token_row reads; its used = false filter matches
+        # the predicate, so Postgres can answer it with an index-only scan.
+        # (sqlite honours sqlite_where; other dialects just get a plain index)
+        Index("reset_tokens_live", "token",
+              postgresql_include=["email", "expires_at"],
+              postgresql_where=text("used = false"), sqlite_where=text("used = 0")),
+    )
+
+# -----------------------------
+# Token cache (optional Redis)
+# -----------------------------
+if REDIS_URL:
+    import redis
+    rcache = redis.Redis.from_url(REDIS_URL)
+else:
+    # no cache configured: every lookup goes to the DB
+    rcache = None
+
+TokenRow = namedtuple("TokenRow", ["email", "expires_at"])
+
+def _cache_key(token: str) -> str:
+    return f"rt:{token}"
+
+# one thread-local session registry shared by web and bot; connections come from the engine pool
+Session = scoped_session(sessionmaker(bind=engine, expire_on_commit=False))
 Base.metadata.create_all(engine)
 
 # -----------------------------
 # DB helpers
 # -----------------------------
 def create_token(email: str) -> str:
-    session = SessionLocal()
-    token = secrets.token_urlsafe(32)
-    now = datetime.utcnow()
+    now = datetime.now(timezone.utc)
     expires = now + timedelta(minutes=RESET_EXPIRY_MINUTES)
-    r = ResetToken(email=email.lower().strip(), token=token, created_at=now, expires_at=expires, used=False)
-    session.add(r)
-    session.commit()
-    session.close()
+    token = sign_token(expires)
+    with Session() as session:
+        r = ResetToken(email=email.lower().strip(), token=token, created_at=now, expires_at=expires, used=False)
+        session.add(r)
+        session.commit()
+    if rcache is not None:
+        try:
+            rcache.setex(_cache_key(token), RESET_EXPIRY_MINUTES * 60, json.dumps({
+                "email": r.email, "expires_at": expires.isoformat()}))
+        except Exception:
+            pass  # cache is best-effort; the DB row is the source of truth
     return token
 
-def get_token_row(token: str):
-    session = SessionLocal()
-    row = session.query(ResetToken).filter(ResetToken.token == token).first()
-    session.close()
-    return row
-
-def mark_used(token: str):
-    session = SessionLocal()
-    row = session.query(ResetToken).filter(ResetToken.token == token).first()
-    if row:
-        row.used = True
+def get_live_token_row(token: str):
+    # only live tokens come back: the cache TTL ends at expiry, consume_token deletes the key,
+    # and the DB query filters on both
+    if not verify_token(token):
+        return None  # forged or expired; skip the cache/DB probe
+    if rcache is not None:
+        try:
+            cached = rcache.get(_cache_key(token))
+        except Exception:
+            cached = None
+        if cached:
+            data = json.loads(cached)
+            expires_at = datetime.fromisoformat(data["expires_at"])
+            if expires_at <= datetime.now(timezone.utc):
+                return None
+            return TokenRow(data["email"], expires_at)
+    with Session() as session:
+        # only the columns we need, under the partial index's own predicate (used = false),
+        # so Postgres can answer from reset_tokens_live without touching the heap
+        row = session.execute(
+            select(ResetToken.email, ResetToken.expires_at)
+            .where(ResetToken.token == token, ResetToken.used == False,  # noqa: E712
+                   ResetToken.expires_at > func.now())
+        ).first()
+        if row is None:
+            return None
+        return TokenRow(*row)
+
+# validate + consume in one round-trip; the used=false guard makes it race-free
+CONSUME_SQL = text(
+    "UPDATE reset_tokens SET used = true "
+    "WHERE token = :t AND used = false AND expires_at > :now "
+    "RETURNING email"
+).bindparams(bindparam("now", type_=DateTime(timezone=True)))
+
+def consume_token(token: str):
+    # returns the token's email, or None if it is unknown, used or expired
+    if not verify_token(token):
+        return None
+    with Session() as session:
+        row = session.execute(CONSUME_SQL, {"t": token, "now": datetime.now(timezone.utc)}).fetchone()
         session.commit()
-    session.close()
+    if row is not None and rcache is not None:
+        try:
+            rcache.delete(_cache_key(token))
+        except Exception:
+            pass
+    return row.email if row is not None else None
+
+def purge_expired_tokens() -> int:
+    # opt-in maintenance (python app.py purge); keeps a day of history for debugging
+    cutoff = datetime.now(timezone.utc) - timedelta(days=1)
+    with Session() as session:
+        result = session.execute(delete(ResetToken).where(ResetToken.expires_at < cutoff))
+        session.commit()
+    return result.rowcount
 
 # -----------------------------
 # Email helper
 # -----------------------------
-def send_reset_email(to_email: str, token: str):
-    reset_link = f"{FRONTEND_BASE.rstrip('/')}{RESET_PATH}?token={token}"
-    msg = EmailMessage()
-    msg["Subject"] = "Password reset request"
-    msg["From"] = FROM_EMAIL or "no-reply@example.com"
-    msg["To"] = to_email
-    msg.set_content(f"""
+# built once: loading the system trust store is ms-class work
+SSL_CTX = ssl.create_default_context()
+
+# built once at import; send only fills in the placeholders
+BODY_TMPL = """
 Hello,
 
 A password reset was requested for this account. If you requested it, open the link below to reset your password:
 
-{reset_link}
+{link}
 
 If you didn't request this, ignore this email.
-This link expires in {RESET_EXPIRY_MINUTES} minutes.
-""")
+This link expires in {mins} minutes.
+"""
 
-    if not SMTP_HOST or not FROM_EMAIL:
-        raise RuntimeError("SMTP not configured. Set SMTP_HOST, SMTP_USER, SMTP_PASS, FROM_EMAIL in env.")
+# one SMTP connection per thread, reused across emails so STARTTLS + AUTH happen once
+SMTP_KEEPALIVE_SECONDS = 60
+_smtp_tls = threading.local()
 
-    ctx = ssl.create_default_context()
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
+def _open_smtp() -> smtplib.SMTP:
+    server = smtplib.SMTP(SMTP_HOST, SMTP_PORT)
+    try:
+        server.starttls(context=SSL_CTX)
+    except Exception:
+        pass
+    if SMTP_USER and SMTP_PASS:
+        server.login(SMTP_USER, SMTP_PASS)
+    return server
+
+def _drop_smtp():
+    server = getattr(_smtp_tls, "server", None)
+    _smtp_tls.server = None
+    if server is not None:
         try:
-            server.starttls(context=ctx)
+            server.quit()
         except Exception:
             pass
-        if SMTP_USER and SMTP_PASS:
-            server.login(SMTP_USER, SMTP_PASS)
-        server.send_message(msg)
 
-# add to app.py (near the Flask routes)
+def get_smtp() -> smtplib.SMTP:
+    server = getattr(_smtp_tls, "server", None)
+    now = time.monotonic()
+    if server is not None and now - _smtp_tls.last_used > SMTP_KEEPALIVE_SECONDS:
+        # idle long enough that the server may have hung up; NOOP before reusing it
+        try:
+            if server.noop()[0] != 250:
+                raise smtplib.SMTPServerDisconnected("NOOP failed")
+        except (smtplib.SMTPException, OSError):
+            _drop_smtp()
+            server = None
+    if server is None:
+        server = _open_smtp()
+        _smtp_tls.server = server
+    _smtp_tls.last_used = now
+    return server
+
+def build_reset_email(to_email: str, token: str) -> EmailMessage:
+    reset_link = f"{FRONTEND_BASE_CLEAN}{RESET_PATH}/{token}"
+    msg = EmailMessage()
+    msg["Subject"] = "Password reset request"
+    msg["From"] = FROM_EMAIL or "no-reply@example.com"
+    msg["To"] = to_email
+    msg.set_content(BODY_TMPL.format(link=reset_link, mins=RESET_EXPIRY_MINUTES))
+    return msg
+
+def _send_message(msg: EmailMessage):
+    if not SMTP_HOST or not FROM_EMAIL:
+        raise RuntimeError("SMTP not configured. Set SMTP_HOST, SMTP_USER, SMTP_PASS, FROM_EMAIL in env.")
+
+    try:
+        get_smtp().send_message(msg)
+    except smtplib.SMTPServerDisconnected:
+        # pooled connection went stale between sends; reconnect and retry once
+        _drop_smtp()
+        get_smtp().send_message(msg)
+
+def send_reset_email(to_email: str, token: str):
+    _send_message(build_reset_email(to_email, token))
+
+def send_reset_batch(items) -> list:
+    # items: [(to_email, token), ...]; all go out over this thread's one SMTP session.
+    # Returns one entry per item: None on success, else the exception.
+    results = []
+    for to_email, token in items:
+        try:
+            send_reset_email(to_email, token)
+            results.append(None)
+        except Exception as e:
+            results.append(e)
+    return results
+
+# -----------------------------
+# Flask web part (reset page)
+# -----------------------------
+class OrjsonProvider(DefaultJSONProvider):
+    # orjson is several times faster than stdlib json on Telegram-sized payloads
+    def dumps(self, obj, **kwargs):
+        # keep the provider's sort_keys contract; datetimes come out as ISO 8601 (orjson native)
+        option = orjson.OPT_SORT_KEYS if kwargs.get("sort_keys", self.sort_keys) else 0
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+web_app = Flask(__name__)
+web_app.json = OrjsonProvider(web_app)
+
+@web_app.teardown_appcontext
+def remove_session(exc=None):
+    # hand the request's connection back to the pool
+    Session.remove()
+
 @web_app.route("/", methods=["GET"])
 def index():
     return (
         "<h3>Reset service running</h3>"
-        "<p>Use <a href=\"/reset\">/reset</a> (provide ?token=...) or POST the form.</p>"
+        "<p>Open the <code>/reset/&lt;token&gt;</code> link from your email, or POST the form there.</p>"
     ), 200
 
 @web_app.route("/health", methods=["GET"])
 def health():
     # simple health endpoint Render (or you) can probe
     return "ok", 200
-    
-# -----------------------------
-# Flask web part (reset page)
-# -----------------------------
-web_app = Flask(__name__)
+
 
 HTML_FORM = """
 <!doctype html>
@@ -186,33 +435,58 @@ HTML_FORM = """
 {% endif %}
 """
 
-@web_app.route(RESET_PATH, methods=["GET"])
-def get_reset():
+# the page only varies by email, so render every variant once at import instead of per request
+with web_app.app_context():
+    ERR_MISSING = render_template_string(HTML_FORM, message="Missing token.", show_form=False).encode()
+    ERR_INVALID = render_template_string(HTML_FORM, message="This link is invalid, expired or has already been used.",
+                                         show_form=False).encode()
+    FORM_TPL = render_template_string(HTML_FORM, message=None, show_form=True, email="{EMAIL}")
+
+ETAG_MISSING = hashlib.md5(ERR_MISSING).hexdigest()
+ETAG_INVALID = hashlib.md5(ERR_INVALID).hexdigest()
+
+def static_page(body: bytes, etag: str) -> Response:
+    # identical for everyone, so let browsers/proxies keep it and revalidate with If-None-Match
+    resp = Response(body, mimetype="text/html")
+    resp.set_etag(etag)
+    resp.cache_control.public = True
+    resp.cache_control.max_age = 60
+    return resp.make_conditional(request)
+
+@web_app.route(RESET_PATH, methods=["GET", "POST"])
+def legacy_reset():
+    # links mailed before tokens moved into the path; 307 keeps the method and form body
     token = request.args.get("token", "")
     if not token:
-        return render_template_string(HTML_FORM, message="Missing token.", show_form=False)
-    row = get_token_row(token)
+        if request.method == "POST":
+            return "Missing token or password", 400
+        return static_page(ERR_MISSING, ETAG_MISSING)
+    return redirect(url_for("get_reset", token=token), code=307)
+
+@web_app.route(f"{RESET_PATH}/<string:token>", methods=["GET"])
+def get_reset(token):
+    # an invalid or used token never becomes usable again, so a client already holding
+    # that page for this URL can be answered without a lookup
+    if ETAG_INVALID in request.if_none_match:
+        return static_page(ERR_INVALID, ETAG_INVALID)  # -> 304 Not Modified
+    row = get_live_token_row(token)
     if not row:
-        return render_template_string(HTML_FORM, message="Invalid token.", show_form=False)
-    if row.used:
-        return render_template_string(HTML_FORM, message="This link has already been used.", show_form=False)
-    if row.expires_at < datetime.utcnow():
-        return render_template_string(HTML_FORM, message="This link has expired.", show_form=False)
-    # Show the password form
-    return render_template_string(HTML_FORM, message=None, show_form=True, email=row.email)
-
-@web_app.route(RESET_PATH, methods=["POST"])
-def post_reset():
-    token = request.args.get("token", "")
+        return static_page(ERR_INVALID, ETAG_INVALID)
+    # Show the password form (per-user, never cached)
+    resp = Response(FORM_TPL.replace("{EMAIL}", html.escape(row.email)), mimetype="text/html")
+    resp.cache_control.no_store = True
+    return resp
+
+@web_app.route(f"{RESET_PATH}/<string:token>", methods=["POST"])
+def post_reset(token):
     password = request.form.get("password", "")
-    if not token or not password:
+    if not password:
         return "Missing token or password", 400
-    row = get_token_row(token)
-    if not row or row.used or row.expires_at < datetime.utcnow():
+    email = consume_token(token)
+    if email is None:
         return "Invalid or expired token", 400
     # TODO: integrate with your users DB here -> find user by email and set hashed password
-    # For now we just mark the token used
-    mark_used(token)
+    # For now the token is just marked used
     return "Password updated (demo). Connect this endpoint to your user DB to actually change passwords."
 
 # -----------------------------
@@ -220,9 +494,18 @@ def post_reset():
 # -----------------------------
 ASK_EMAIL = 0
 
-EMAIL_RE = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s]+")
 def valid_email(email: str) -> bool:
-    return EMAIL_RE.match(email) is not None
+    # same rule as \A[^@\s]+@[^@\s]+\.[^@\s]+\Z, as a linear scan: no regex
+    # backtracking on hostile input from Telegram users
+    if len(email) > 254:
+        return False
+    at = email.find("@")
+    if at <= 0 or email.find("@", at + 1) != -1:
+        return False
+    # need a dot in the domain with at least one char on each side
+    if email.find(".", at + 2, len(email) - 1) == -1:
+        return False
+    return not any(c.isspace() for c in email)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard = [[InlineKeyboardButton("🔄 Reset Password", callback_data="reset")]]
@@ -245,25 +528,87 @@ async def receive_email(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("That doesn't look like a valid email. Please try again.")
         return ASK_EMAIL
 
-    token = create_token(user_text)
-    try:
-        send_reset_email(user_text, token)
-    except Exception as e:
-        await update.message.reply_text("Failed to send email. Check SMTP settings in environment variables.")
-        return ConversationHandler.END
-
-    await update.message.reply_text(f"Reset link sent to {user_text}. Check your email.")
+    # the DB insert is blocking; keep it off the event loop (in webhook mode it also serves HTTP)
+    token = await asyncio.to_thread(create_token, user_text)
+    # mail_drainer sends it (batched with any others queued meanwhile); the user gets an answer right away
+    await OUTBOX.put((user_text, token, update))
+    await update.message.reply_text(f"Sending a reset link to {user_text}. Check your email.")
     return ConversationHandler.END
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Cancelled.")
     return ConversationHandler.END
 
-async def run_bot():
+# -----------------------------
+# Outgoing mail (coalesced)
+# -----------------------------
+MAIL_BATCH_SIZE = 20
+MAIL_BATCH_WINDOW = 0.05  # seconds to wait for more mail once the first one is queued
+OUTBOX: asyncio.Queue = asyncio.Queue()
+
+def mail_executor(application: Application) -> ThreadPoolExecutor:
+    executor = application.bot_data.get("mail_executor")
+    if executor is None:
+        # caps concurrent SMTP sessions; each thread keeps its own pooled connection
+        executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="smtp")
+        application.bot_data["mail_executor"] = executor
+    return executor
+
+async def mail_drainer(application: Application):
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await OUTBOX.get()]
+        deadline = loop.time() + MAIL_BATCH_WINDOW
+        while len(batch) < MAIL_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(OUTBOX.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        future = loop.run_in_executor(mail_executor(application), send_reset_batch,
+                                      [(to_email, token) for to_email, token, _ in batch])
+        # don't wait for SMTP here, so a slow batch doesn't hold up the next one
+        application.create_task(report_batch_result([update for _, _, update in batch], future))
+
+async def report_batch_result(updates, future):
+    try:
+        results = await future
+    except Exception as e:
+        results = [e] * len(updates)
+    for update, error in zip(updates, results):
+        if error is not None:
+            print(f"Failed to send reset email: {error!r}")
+            await update.message.reply_text("Failed to send email. Check SMTP settings in environment variables.")
+
+async def start_mail_drainer(application: Application):
+    # task handle kept in bot_data so it isn't garbage-collected
+    application.bot_data["mail_drainer"] = asyncio.create_task(mail_drainer(application))
+
+async def stop_mail_drainer(application: Application):
+    drainer = application.bot_data.pop("mail_drainer", None)
+    if drainer is not None:
+        drainer.cancel()
+        try:
+            await drainer
+        except asyncio.CancelledError:
+            pass
+    executor = application.bot_data.pop("mail_executor", None)
+    if executor is not None:
+        # let batches already handed to SMTP finish, without blocking the loop
+        await asyncio.to_thread(executor.shutdown)
+
+def build_bot_app(webhook: bool = False) -> Application:
     if not BOT_TOKEN:
         raise RuntimeError("BOT_TOKEN env variable is required for bot mode")
 
-    app = Application.builder().token(BOT_TOKEN).build()
+    builder = (Application.builder().token(BOT_TOKEN)
+               .post_init(start_mail_drainer).post_shutdown(stop_mail_drainer))
+    if webhook:
+        # Telegram pushes updates to our web route; no long-polling Updater needed
+        builder = builder.updater(None)
+    app = builder.build()
 
     conv = ConversationHandler(
         entry_points=[CommandHandler("reset", reset_command)],
@@ -275,21 +620,90 @@ async def run_bot():
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CallbackQueryHandler(button_callback))
     app.add_handler(conv)
+    return app
 
+def run_bot():
+    # local testing only; on Render the bot runs as a webhook inside asgi_app
+    app = build_bot_app()
     print("Starting Telegram bot (polling).")
-    await app.run_polling()
+    app.run_polling()
+
+# -----------------------------
+# Webhook mode (web + bot in one ASGI service)
+# -----------------------------
+WEBHOOK_PATH = f"/tg/{BOT_TOKEN}"
+bot_app = build_bot_app(webhook=True) if BOT_TOKEN else None
+bot_loop = None  # set on ASGI startup; the loop bot_app runs on
+
+if bot_app is not None:
+    @web_app.route(WEBHOOK_PATH, methods=["POST"])
+    def telegram_webhook():
+        if bot_loop is None:
+            return "Bot not started (serve asgi_app to enable the webhook)", 503
+        try:
+            # straight from the raw body: skips the provider wrapper and the request data cache
+            payload = orjson.loads(request.get_data(cache=False))
+        except orjson.JSONDecodeError:
+            return "Bad update payload", 400
+        if not isinstance(payload, dict):
+            return "Bad update payload", 400
+        update = Update.de_json(payload, bot_app.bot)
+        # Flask runs in a2wsgi's thread pool; hand the update over to the bot's event loop
+        asyncio.run_coroutine_threadsafe(bot_app.update_queue.put(update), bot_loop).result()
+        return "", 200
+
+# a2wsgi runs Flask on a real thread pool; asgiref's WsgiToAsgi pins every request to one
+# shared thread, which would serialize the whole service. Sized to the DB pool (pool_size).
+_flask_asgi = WSGIMiddleware(web_app, workers=WSGI_THREADS)
+
+async def _lifespan(receive, send):
+    global bot_loop
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            if bot_app is not None:
+                try:
+                    await bot_app.initialize()
+                    await bot_app.start()
+                    await start_mail_drainer(bot_app)  # post_init only runs under run_polling/run_webhook
+                    await bot_app.bot.set_webhook(f"{FRONTEND_BASE_CLEAN}{WEBHOOK_PATH}")
+                except Exception as e:
+                    # report it so the server exits instead of serving a webhook that drops updates
+                    await send({"type": "lifespan.startup.failed",
+                                "message": f"Telegram bot failed to start: {e!r}"})
+                    return
+                # only now may the webhook route hand updates over
+                bot_loop = asyncio.get_running_loop()
+                print("Telegram bot started (webhook).")
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if bot_app is not None:
+                await bot_app.stop()
+                await stop_mail_drainer(bot_app)  # post_shutdown only runs under run_polling/run_webhook
+                await bot_app.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+async def asgi_app(scope, receive, send):
+    # lifespan (bot start/stop) is handled here; everything else goes to Flask
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+    else:
+        await _flask_asgi(scope, receive, send)
 
 # -----------------------------
 # Entrypoint
 # -----------------------------
 if __name__ == "__main__":
     if len(sys.argv) >= 2 and sys.argv[1].lower() == "bot":
-        import asyncio
-        asyncio.run(run_bot())
+        run_bot()
     elif len(sys.argv) >= 2 and sys.argv[1].lower() == "web":
         # run built-in server (use gunicorn on Render)
         web_app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 8000)))
+    elif len(sys.argv) >= 2 and sys.argv[1].lower() == "purge":
+        print(f"Deleted {purge_expired_tokens()} expired reset tokens.")
     else:
-        print("Usage: python app.py [bot|web]")
-        print("- Bot mode (startCommand): python app.py bot")
-        print("- Web mode (gunicorn): gunicorn app:web_app -b 0.0.0.0:$PORT")
+        print("Usage: python app.py [bot|web|purge]")
+        print("- Bot mode (local polling): python app.py bot")
+        print("- Web + bot webhook (gunicorn): GUNICORN_WORKER_CLASS=uvicorn_worker.UvicornWorker gunicorn app:asgi_app -b 0.0.0.0:$PORT")
+        print("- Purge expired tokens (optional): python app.py purge")
@@ -0,0 +1,47 @@
+# gunicorn.conf.py
+"""
+Gunicorn settings for the web service (loaded automatically from the working dir).
+
+The reset endpoints are I/O-bound (Postgres, Redis, SMTP), so by default we use
+gevent workers: each process multiplexes up to worker_connections requests
+instead of blocking on one.
+
+Recipes (all via env, so render.yaml / the CLI stay the same):
+- async, I/O-bound (default):  GUNICORN_WORKER_CLASS=gevent
+- sync, threaded:              GUNICORN_WORKER_CLASS=gthread  (2 threads per worker)
+- web + Telegram webhook:      GUNICORN_WORKER_CLASS=uvicorn_worker.UvicornWorker, serve app:asgi_app
+                               (asyncio, no gevent patching)
+
+Worker count defaults to 2 * CPUs + 1; override with WEB_CONCURRENCY.
+preload_app imports app.py once in the master so the engine, compiled regexes and
+pre-rendered pages are shared copy-on-write across workers.
+"""
+
+import os
+
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gevent")
+
+if worker_class == "gevent":
+    # app.py monkey-patches on import when this is set; must be in place before preload imports it
+    os.environ.setdefault("GEVENT_PATCH", "1")
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_connections = 1000
+workers = int(os.environ.get("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1))
+if worker_class in ("sync", "gthread"):
+    worker_class = "gthread"
+    threads = 2
+preload_app = True
+
+# recycle workers periodically to contain slow leaks; jitter so they don't all restart together.
+# Not for the webhook worker: a restart would drop the bot's in-memory conversation state.
+if worker_class != "uvicorn_worker.UvicornWorker":
+    max_requests = 1000
+    max_requests_jitter = 200
+
+
+def post_fork(server, worker):
+    # the preloaded engine's pooled sockets were opened in the master; drop them from this
+    # worker's pool without closing them, so the master's (and siblings') connections stay intact
+    from app import engine
+    engine.dispose(close=False)